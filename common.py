@@ -2,18 +2,43 @@
 Common classes/methods not directly related to the project.
 """
 
+import os
+import re
+import mmap
+from functools import lru_cache
+from itertools import accumulate
 from PyQt5 import QtWidgets, QtCore, QtGui
 
+# files of at least this size (in bytes) are read via a memory map
+large_file_size = 1 << 20
+
 
 def read_text(file):
     """
-    Reads a whole text file (UTF-8 encoded).
+    Reads a whole text file (UTF-8 encoded). Invalid bytes are ignored, line endings are translated to '\n'.
     """
-    with open(file, mode='r', encoding='utf-8', errors='ignore') as f:
-        text = f.read()
+    with open(file, mode='rb') as f:
+        if os.fstat(f.fileno()).st_size < large_file_size:
+            text = decode_text(f.read())
+        else:
+            # decode directly from a memory map, without an intermediate copy of the whole file as bytes
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                text = decode_text(data)
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
     return text
 
 
+def decode_text(data):
+    """
+    Decodes UTF-8 encoded data (bytes or any buffer) in one go, the ignoring decoder is only needed for invalid data.
+    """
+    try:
+        return str(data, encoding='utf-8')
+    except UnicodeDecodeError:
+        return str(data, encoding='utf-8', errors='ignore')
+
+
 def write_text(file, text):
     """
     Writes a whole text file (UTF-8 encoded).
@@ -22,6 +47,61 @@ def write_text(file, text):
         f.write(text)
 
 
+def write_text_atomically(file, text):
+    """
+    Writes a whole text file (UTF-8 encoded) into a temporary file next to it, which then replaces the file. The file
+    is either completely written or not changed at all (e.g. if the program is stopped while writing).
+    """
+    temporary_file = file + '.tmp'
+    write_text(temporary_file, text)
+    os.replace(temporary_file, file)
+
+
+def common_prefix_length(a, b):
+    """
+    Length of the longest common prefix of two strings (bisection, the comparisons run in C).
+    """
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def common_suffix_length(a, b, limit):
+    """
+    Length of the longest common suffix of two strings, but at most limit.
+    """
+    low, high = 0, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[len(a) - middle:] == b[len(b) - middle:]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def utf16_length(text):
+    """
+    Length of a string in UTF-16 code units (as used for positions in Qt).
+    """
+    return len(text.encode('utf-16-le')) // 2
+
+
+def utf16_offsets(text):
+    """
+    Positions in UTF-16 code units (as used for positions in Qt) of all positions (code points, including the end) of
+    a string. None if they are the same, i.e. if there are no characters outside of the Basic Multilingual Plane.
+    """
+    if text.isascii() or max(text) <= '\uffff':
+        return None
+    return list(accumulate((2 if character > '\uffff' else 1 for character in text), initial=0))
+
+
 class LineNumberArea(QtWidgets.QWidget):
     """
     Translated from https://doc.qt.io/qt-5/qtwidgets-widgets-codeeditor-example.html
@@ -31,6 +111,10 @@ class LineNumberArea(QtWidgets.QWidget):
         super().__init__(editor)
         self.editor = editor
 
+        # painting fills the whole exposed area, Qt does not need to clear the widget before painting
+        self.setAttribute(QtCore.Qt.WA_OpaquePaintEvent, True)
+        self.setAttribute(QtCore.Qt.WA_NoSystemBackground, True)
+
     def sizeHint(self) -> QtCore.QSize:
         return QtCore.QSize(self.editor.lineNumberAreaWidth(), 0)
 
@@ -49,8 +133,11 @@ class CodeEditor(QtWidgets.QPlainTextEdit):
         self.show_line_numbers = show_line_numbers
 
         self.line_number_area = LineNumberArea(self)
+        self.cached_line_number_area_width = None
+        self.no_scroll_text = None
+        self.no_scroll_revision = None
 
-        self.blockCountChanged.connect(self.updateLineNumberAreaWidth)
+        self.blockCountChanged.connect(self.invalidateLineNumberAreaWidth)
         self.updateRequest.connect(self.updateLineNumberArea)
 
         self.updateLineNumberAreaWidth(0)
@@ -58,6 +145,18 @@ class CodeEditor(QtWidgets.QPlainTextEdit):
     def updateLineNumberAreaWidth(self, newBlockCount):
         self.setViewportMargins(self.lineNumberAreaWidth(), 0, 0, 0)
 
+    def invalidateLineNumberAreaWidth(self, newBlockCount=0):
+        """
+        Addition: The width of the line number area is cached and only recomputed if the block count or the font changes.
+        """
+        self.cached_line_number_area_width = None
+        self.updateLineNumberAreaWidth(newBlockCount)
+
+    def changeEvent(self, e: QtCore.QEvent) -> None:
+        super().changeEvent(e)
+        if e.type() == QtCore.QEvent.FontChange:
+            self.invalidateLineNumberAreaWidth()
+
     def resizeEvent(self, e: QtGui.QResizeEvent) -> None:
         super().resizeEvent(e)
 
@@ -77,28 +176,31 @@ class CodeEditor(QtWidgets.QPlainTextEdit):
         if not self.show_line_numbers:
             return 0
 
-        digits = 1
-        maximum = max(1, self.blockCount())
-        while maximum >= 10:
-            maximum /= 10
-            digits += 1
-
-        space = 3 + self.fontMetrics().horizontalAdvance('9') * digits
-        return space
+        if self.cached_line_number_area_width is None:
+            digits = len(str(max(1, self.blockCount())))
+            self.cached_line_number_area_width = 3 + self.fontMetrics().horizontalAdvance('9') * digits
+        return self.cached_line_number_area_width
 
     def lineNumberAreaPaintEvent(self, event):
         painter = QtGui.QPainter(self.line_number_area)
+        painter.setClipRect(event.rect())
         painter.fillRect(event.rect(), QtCore.Qt.lightGray)
+        painter.setPen(QtCore.Qt.black)
+
+        # constant during the loop
+        event_top = event.rect().top()
+        event_bottom = event.rect().bottom()
+        width = self.line_number_area.width()
+        height = self.fontMetrics().height()
 
         block = self.firstVisibleBlock()
         blockNumber = block.blockNumber()
         top = round(self.blockBoundingGeometry(block).translated(self.contentOffset()).top())
         bottom = top + round(self.blockBoundingRect(block).height())
-        while block.isValid() and top <= event.rect().bottom():
-            if block.isVisible() and bottom >= event.rect().top():
+        while block.isValid() and top <= event_bottom:
+            if block.isVisible() and bottom >= event_top:
                 number = str(blockNumber + 1)
-                painter.setPen(QtCore.Qt.black)
-                painter.drawText(0, top, self.line_number_area.width(), self.fontMetrics().height(), QtCore.Qt.AlignRight, number)
+                painter.drawText(0, top, width, height, QtCore.Qt.AlignRight, number)
 
             block = block.next()
             top = bottom
@@ -108,16 +210,42 @@ class CodeEditor(QtWidgets.QPlainTextEdit):
     def setTextNoScroll(self, text):
         """
         Addition: Tries to keep the vertical scroll bar position when setting a new text.
+        If the document hasn't been changed otherwise since the last call, only the part of the text that differs is
+        replaced, so that Qt only needs to lay out the changed blocks again (and nothing if the text is the same).
         """
+        document = self.document()
+        unchanged = self.no_scroll_text is not None and self.no_scroll_revision == document.revision()
+        if unchanged and self.no_scroll_text == text:
+            return
+
+        # no repaints until the text is set and scrolled back
+        self.setUpdatesEnabled(False)
         vertical_scroll_position = self.verticalScrollBar().sliderPosition()
-        self.clear()
-        self.setPlainText(text)
+        if unchanged:
+            old_text = self.no_scroll_text
+            prefix = common_prefix_length(old_text, text)
+            suffix = common_suffix_length(old_text, text, min(len(old_text), len(text)) - prefix)
+            # no undo history (like setPlainText), and cursor positions count UTF-16 code units
+            document.setUndoRedoEnabled(False)
+            cursor = QtGui.QTextCursor(document)
+            cursor.setPosition(utf16_length(old_text[:prefix]))
+            cursor.setPosition(utf16_length(old_text[:len(old_text) - suffix]), QtGui.QTextCursor.KeepAnchor)
+            cursor.insertText(text[prefix:len(text) - suffix])
+            document.setUndoRedoEnabled(True)
+        else:
+            self.clear()
+            self.setPlainText(text)
+        self.no_scroll_text = self.toPlainText()
+        self.no_scroll_revision = document.revision()
         self.verticalScrollBar().setSliderPosition(vertical_scroll_position)
+        self.setUpdatesEnabled(True)
 
 
+@lru_cache(maxsize=None)
 def createTextCharFormat(foreground_color=None, background_color=None, style=None):
     """
-    Return a QTextCharFormat with the given attributes.
+    Return a QTextCharFormat with the given attributes. Formats (and their colors) are only created once for the same
+    attributes and then shared, do not modify them.
     """
     char_format = QtGui.QTextCharFormat()
     if foreground_color:
@@ -174,65 +302,89 @@ class PythonHighlighter(QtGui.QSyntaxHighlighter):
     # Python braces
     braces = [r'\{', r'\}', r'\(', r'\)', r'\[', r'\]']
 
+    # Multi-line strings (expression, flag, style)
+    # FIXME: The triple-quotes in these two lines will mess up the syntax highlighting from this point onward
+    tri_single = (re.compile("'''"), 1, styles['string2'])
+    tri_double = (re.compile('"""'), 2, styles['string2'])
+
+    # compiled expression for all tokens, shared by all instances and built on first use
+    expression = None
+
+    # documents with more characters are not highlighted (None for no limit)
+    maximum_characters = None
+
     def __init__(self, *args, **kwargs):
         """
-        Defines the Basic rules as well as color scheme
+        Compiles the expression when the first highlighter is created.
         """
         super().__init__(*args, **kwargs)
 
-        # Multi-line strings (expression, flag, style)
-        # FIXME: The triple-quotes in these two lines will mess up the syntax highlighting from this point onward
-        self.tri_single = (QtCore.QRegExp("'''"), 1, PythonHighlighter.styles['string2'])
-        self.tri_double = (QtCore.QRegExp('"""'), 2, PythonHighlighter.styles['string2'])
+        # UTF-16 positions of the code points of the current block (None if they are the same)
+        self.offsets = None
 
-        rules = []
+        if PythonHighlighter.expression is None:
+            PythonHighlighter.expression = PythonHighlighter.compile_expression()
 
-        # keyword, operator, and brace rules
-        rules += [(r'\b%s\b' % w, 0, PythonHighlighter.styles['keyword']) for w in PythonHighlighter.keywords]
-        rules += [(r'%s' % o, 0, PythonHighlighter.styles['operator']) for o in PythonHighlighter.operators]
-        rules += [(r'%s' % b, 0, PythonHighlighter.styles['brace']) for b in PythonHighlighter.braces]
+    @staticmethod
+    def compile_expression():
+        """
+        Combines all rules into a single regular expression with one named group per style, so that a block is
+        tokenized in a single pass. Earlier alternatives take precedence (e.g. a '#' in a string is not a comment).
+        Only needs to be done once, the result is shared by all highlighters.
+        """
+        operators = sorted(PythonHighlighter.operators, key=len, reverse=True)  # longer operators first
 
-        # all other rules
-        rules += [
-            # 'self'
-            (r'\bself\b', 0, PythonHighlighter.styles['self']),
+        rules = [
+            # from '#' until a newline
+            ('comment', r'#[^\n]*'),
 
-            # Double-quoted string, possibly containing escape sequences
-            (r'"[^"\\]*(\\.[^"\\]*)*"', 0, PythonHighlighter.styles['string']),
-            # Single-quoted string, possibly containing escape sequences
-            (r"'[^'\\]*(\\.[^'\\]*)*'", 0, PythonHighlighter.styles['string']),
+            # Double- or single-quoted string, possibly containing escape sequences
+            ('string', r'"[^"\\]*(?:\\.[^"\\]*)*"|\'[^\'\\]*(?:\\.[^\'\\]*)*\''),
 
-            # 'def' followed by an identifier
-            (r'\bdef\b\s*(\w+)', 1, PythonHighlighter.styles['defclass']),
-            # 'class' followed by an identifier
-            (r'\bclass\b\s*(\w+)', 1, PythonHighlighter.styles['defclass']),
+            # 'def' or 'class' followed by an identifier
+            ('defclass', r'\b(?P<defclass_keyword>def|class)\b\s*(?P<name>\w+)'),
 
-            # from '#' until a newline
-            (r'#[^\n]*', 0, PythonHighlighter.styles['comment']),
+            # keywords, 'self'
+            ('keyword', r'\b(?:%s)\b' % '|'.join(PythonHighlighter.keywords)),
+            ('self', r'\bself\b'),
 
             # Numeric literals
-            (r'\b[+-]?[0-9]+[lL]?\b', 0, PythonHighlighter.styles['numbers']),
-            (r'\b[+-]?0[xX][0-9A-Fa-f]+[lL]?\b', 0, PythonHighlighter.styles['numbers']),
-            (r'\b[+-]?[0-9]+(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?\b', 0, PythonHighlighter.styles['numbers']),
+            ('numbers', r'\b[+-]?(?:0[xX][0-9A-Fa-f]+[lL]?|[0-9]+(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?[lL]?)\b'),
+
+            # operators, braces
+            ('operator', '|'.join(operators)),
+            ('brace', '[%s]' % ''.join(PythonHighlighter.braces)),
         ]
 
-        # Build a QRegExp for each pattern
-        self.rules = [(QtCore.QRegExp(pattern), index, fmt) for (pattern, index, fmt) in rules]
+        return re.compile('|'.join('(?P<{}>{})'.format(name, pattern) for name, pattern in rules))
 
     def highlightBlock(self, text: str) -> None:
         """
         Highlights a given block of text.
         """
-        # Do other syntax formatting
-        for expression, nth, format in self.rules:
-            index = expression.indexIn(text, 0)
+        if self.maximum_characters and self.document().characterCount() > self.maximum_characters:
+            return
+
+        # blank lines have nothing to highlight, but a multi-line string continues through them
+        if not text or text.isspace():
+            self.setCurrentBlockState(max(self.previousBlockState(), 0))
+            return
 
-            while index >= 0:
-                # We actually want the index of the nth match
-                index = expression.pos(nth)
-                length = len(expression.cap(nth))
-                self.setFormat(index, length, format)
-                index = expression.indexIn(text, index + length)
+        styles = PythonHighlighter.styles
+
+        # positions of Python regular expressions are code points, Qt wants UTF-16 positions
+        self.offsets = utf16_offsets(text)
+
+        # Do other syntax formatting
+        for match in self.expression.finditer(text):
+            style = match.lastgroup
+            start, end = match.span()
+            if style == 'defclass':
+                # the keyword, then the name
+                keyword_start, keyword_end = match.span('defclass_keyword')
+                self.set_format(keyword_start, keyword_end - keyword_start, styles['keyword'])
+                start, end = match.span('name')
+            self.set_format(start, end - start, styles[style])
 
         self.setCurrentBlockState(0)
 
@@ -244,40 +396,57 @@ class PythonHighlighter(QtGui.QSyntaxHighlighter):
     def match_multiline(self, text, delimiter, in_state, style):
         """
         Do highlighting of multi-line strings. ``delimiter`` should be a
-        ``QRegExp`` for triple-single-quotes or triple-double-quotes, and
+        compiled regular expression for triple-single-quotes or triple-double-quotes, and
         ``in_state`` should be a unique integer to represent the corresponding
         state changes when inside those strings. Returns True if we're still
         inside a multi-line string when this function is finished.
         """
+        delimiter_length = len(delimiter.pattern)
+        text_length = len(text)
+        inside = False
+
         # If inside triple-single quotes, start at 0
         if self.previousBlockState() == in_state:
             start = 0
             add = 0
         # Otherwise, look for the delimiter on this line
         else:
-            start = delimiter.indexIn(text)
+            match = delimiter.search(text)
+            start = match.start() if match else -1
             # Move past this match
-            add = delimiter.matchedLength()
+            add = delimiter_length
 
         # As long as there's a delimiter match on this line...
         while start >= 0:
             # Look for the ending delimiter
-            end = delimiter.indexIn(text, start + add)
+            match = delimiter.search(text, start + add)
             # Ending delimiter on this line?
-            if end >= add:
-                length = end - start + add + delimiter.matchedLength()
-                self.setCurrentBlockState(0)
-            # No; multi-line string
-            else:
+            inside = match is None
+            if inside:
+                # No; multi-line string
                 self.setCurrentBlockState(in_state)
-                length = len(text) - start + add
+                length = text_length - start + add
+            else:
+                length = match.start() - start + add + delimiter_length
+                self.setCurrentBlockState(0)
             # Apply formatting
-            self.setFormat(start, length, style)
+            self.set_format(start, length, style)
             # Look for the next match
-            start = delimiter.indexIn(text, start + length)
+            match = delimiter.search(text, start + length)
+            start = match.start() if match else -1
 
-        # Return True if still inside a multi-line string, False otherwise
-        if self.currentBlockState() == in_state:
-            return True
-        else:
-            return False
+        # True if still inside a multi-line string, False otherwise
+        return inside
+
+    def set_format(self, start, length, style):
+        """
+        Like setFormat, but start and length are given in code points (of the current block text).
+        """
+        offsets = self.offsets
+        if offsets is not None:
+            # lengths may reach beyond the end of the text, that part is not converted
+            end = start + length
+            last = len(offsets) - 1
+            start = offsets[start]
+            length = offsets[min(end, last)] + max(end - last, 0) - start
+        self.setFormat(start, length, style)
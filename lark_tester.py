@@ -5,10 +5,13 @@
 
 import sys
 import os
+import io
 import traceback
-from functools import partial
+import bisect
+import hashlib
+from functools import partial, lru_cache
 import json
-from lark import Lark, Transformer, Discard, v_args  # Transformer, Discard, v_args might be used in the Transformer
+from lark import Lark, Tree, Transformer, Discard, v_args  # Transformer, Discard, v_args might be used in the Transformer
 from PyQt5 import QtWidgets, QtCore, QtGui
 import common
 
@@ -18,6 +21,12 @@ lark_parser_names = ('Earley', 'LALR(1)', 'CYK')
 minimal_window_size = (1200, 800)
 number_tabs = 4
 automatic_save_preferences = ['Ask for every open file', 'Always save', 'Never save']
+update_delay = 250  # in ms, requests for a Lark run within this time are combined into one
+maximum_parsed_length = 1000000  # the displayed parsed tree is truncated after this many characters
+maximum_transformed_length = 1000000  # the displayed transformed result is truncated after this many characters
+large_earley_content_length = 50000  # for longer contents, the Earley parser might be slow (suggest LALR(1) once)
+search_delay = 150  # in ms, changes of the search text or the searched text within this time are combined
+maximum_search_results = 1000  # only this many search results are highlighted
 
 # default settings
 default_settings = {
@@ -26,8 +35,10 @@ default_settings = {
     'options.edit.wrap_lines': True,
     'options.edit.show_line_numbers': True,
     'options.edit.automatic_save_preference': 0,
-    'options.lark.parser': 0,
+    'options.edit.highlight.maximum_characters': 262144,
+    'options.lark.parser': lark_parsers.index('lalr'),
     'options.lark.starting_rule': 'start',
+    'options.lark.run_while_typing': True,
     'window.size.width': minimal_window_size[0],
     'window.size.height': minimal_window_size[1],
     'window.splitter.columns.size': None,
@@ -91,6 +102,7 @@ class TextEdit(common.CodeEditor):
         self.mode = mode
         self.tooltip_changer = tooltip_changer
         self.file = None
+        self.deferred_load = False
         self.read_content = ''
         if self.mode == 'grammar':
             self.file_filter = "Lark grammar (*.lark);;All files (*.*)"
@@ -119,10 +131,36 @@ class TextEdit(common.CodeEditor):
         else:
             content = ''
         self.setPlainText(content)
+        self.document().setModified(True)  # the default text has not been saved yet
         self.file = None
         self.tooltip_changer(self.file)
         self.read_content = ''
 
+    def load_deferred(self, file):
+        """
+        Loads content from a file, but only when the text edit is shown for the first time (e.g. when its tab is
+        selected), so that files of tabs that are never looked at are neither read nor highlighted.
+        :param file: The file that content should be loaded from.
+        """
+        if self.isVisible() or not os.path.isfile(file):
+            self.load(file)
+        else:
+            self.file = file
+            self.tooltip_changer(self.file)
+            self.deferred_load = True
+
+    def showEvent(self, e: QtGui.QShowEvent) -> None:
+        """
+        Loads a deferred file.
+        """
+        super().showEvent(e)
+        if self.deferred_load:
+            self.deferred_load = False
+            file = self.file
+            self.file = None
+            self.tooltip_changer(self.file)
+            self.load(file)
+
     def load(self, file=None):
         """
         Loads content from a file.
@@ -151,6 +189,7 @@ class TextEdit(common.CodeEditor):
         if settings['options.edit.tabs.replace']:
             content = content.replace('\t', ' ' * settings['options.edit.tabs.replacement_spaces'])
         self.setPlainText(content)
+        self.document().setModified(content != self.read_content)  # replaced tabs are not saved yet
 
     def save(self):
         """
@@ -174,12 +213,14 @@ class TextEdit(common.CodeEditor):
         self.file = file
         self.tooltip_changer(self.file)
         self.read_content = content
+        self.document().setModified(False)
 
     def is_modified(self):
         """
+        The document tracks whether it was edited since the last setPlainText or save, only then the text is compared.
         :return: True if the content has been modified since the last load/save operation.
         """
-        return self.read_content != self.toPlainText()
+        return self.document().isModified() and self.read_content != self.toPlainText()
 
 
 class TabWidget(QtWidgets.QTabWidget):
@@ -227,9 +268,13 @@ class SettingsWindow(QtWidgets.QWidget):
 
         self.lark_start_rule_edit = QtWidgets.QLineEdit(settings['options.lark.starting_rule'])
 
+        self.lark_run_while_typing = QtWidgets.QCheckBox()
+        self.lark_run_while_typing.setChecked(settings['options.lark.run_while_typing'])
+
         l = QtWidgets.QFormLayout(lark_groupbox)
         l.addRow('Parser', self.lark_parser_combobox)
         l.addRow('Starting rule', QtWidgets.QLineEdit('start'))
+        l.addRow('Parse and transform while typing', self.lark_run_while_typing)
 
         # edits group box
         edits_groupbox = QtWidgets.QGroupBox('Edit')
@@ -246,6 +291,11 @@ class SettingsWindow(QtWidgets.QWidget):
         self.edit_automatic_save = QtWidgets.QComboBox()
         self.edit_automatic_save.addItems(automatic_save_preferences)
         self.edit_automatic_save.setCurrentIndex(settings['options.edit.automatic_save_preference'])
+        self.edit_highlight_maximum_characters = QtWidgets.QSpinBox()
+        self.edit_highlight_maximum_characters.setRange(0, 100000000)
+        self.edit_highlight_maximum_characters.setSingleStep(65536)
+        self.edit_highlight_maximum_characters.setSpecialValueText('Unlimited')
+        self.edit_highlight_maximum_characters.setValue(settings['options.edit.highlight.maximum_characters'])
 
         l = QtWidgets.QFormLayout(edits_groupbox)
         l.addRow('Replace tabs', self.edit_replace_tabs)
@@ -253,6 +303,7 @@ class SettingsWindow(QtWidgets.QWidget):
         l.addRow('Wrap lines', self.edit_wrap_lines)
         l.addRow('Show line numbers', self.edit_show_line_numbers)
         l.addRow('Automatic save on exit', self.edit_automatic_save)
+        l.addRow('Highlight syntax up to characters', self.edit_highlight_maximum_characters)
 
         # put all the group boxes in one layout
         layout = QtWidgets.QVBoxLayout(self)
@@ -270,11 +321,13 @@ class SettingsWindow(QtWidgets.QWidget):
         starting_rule = self.lark_start_rule_edit.text()
         if starting_rule:
             settings['options.lark.starting_rule'] = starting_rule
+        settings['options.lark.run_while_typing'] = self.lark_run_while_typing.isChecked()
         settings['options.edit.tabs.replace'] = self.edit_replace_tabs.isChecked()
         settings['options.edit.tabs.replacement_spaces'] = self.edit_number_spaces.value()
         settings['options.edit.wrap_lines'] = self.edit_wrap_lines.isChecked()
         settings['options.edit.show_line_numbers'] = self.edit_show_line_numbers.isChecked()
         settings['options.edit.automatic_save_preference'] = self.edit_automatic_save.currentIndex()
+        settings['options.edit.highlight.maximum_characters'] = self.edit_highlight_maximum_characters.value()
 
 
 class LarkHighlighter(QtGui.QSyntaxHighlighter):
@@ -293,38 +346,63 @@ class LarkHighlighter(QtGui.QSyntaxHighlighter):
 
     operators = ('|', '?', '*', '+', '~')
 
+    # compiled expression for all rules, shared by all instances and built on first use
+    expression = None
+
+    # documents with more characters are not highlighted (None for no limit)
+    maximum_characters = None
+
     def __init__(self, *args, **kwargs):
         """
-        Defines the Basic rules as well as color schemes.
+        Compiles the expression when the first highlighter is created.
         """
         super().__init__(*args, **kwargs)
 
-        rules = []
+        if LarkHighlighter.expression is None:
+            LarkHighlighter.expression = LarkHighlighter.compile_expression()
 
-        # rules
-        rules += [(r'{}\b'.format(s), 'statement') for s in LarkHighlighter.statements]
+    @staticmethod
+    def compile_expression():
+        """
+        Combines the basic rules into a single regular expression with one named group per style, so that a block is
+        scanned only once. Only needs to be done once, the result is shared by all highlighters.
+        """
+        rules = [
+            # all statements as a single alternation
+            ('statement', r'(?:{})\b'.format('|'.join(LarkHighlighter.statements))),
 
-        rules += [
-            # from '#' until a newline
-            (r'\/\/[^\n]*', 'comment'),
+            # from '//' until a newline
+            ('comment', r'\/\/[^\n]*'),
 
             # Double-quoted string, possibly containing escape sequences
-            (r'"[^"\\]*(\\.[^"\\]*)*"', 'string'),
+            ('string', r'"[^"\\]*(?:\\.[^"\\]*)*"'),
         ]
 
-        self.rules = [(QtCore.QRegularExpression(pattern), LarkHighlighter.styles[format]) for (pattern, format) in rules]
+        expression = QtCore.QRegularExpression('|'.join('(?<{}>{})'.format(name, pattern) for name, pattern in rules))
+        expression.optimize()  # compile now, not on the first use in highlightBlock
+        return expression
 
     def highlightBlock(self, text: str) -> None:
         """
         Highlights a block.
         """
+        if self.maximum_characters and self.document().characterCount() > self.maximum_characters:
+            return
+
+        # nothing to highlight on blank lines
+        if not text or text.isspace():
+            return
 
-        for regex, fmt in self.rules:
+        styles = LarkHighlighter.styles
 
-            i = regex.globalMatch(text)
-            while i.hasNext():
-                match = i.next()
-                self.setFormat(match.capturedStart(), match.capturedLength(), fmt)
+        i = self.expression.globalMatch(text)
+        while i.hasNext():
+            match = i.next()
+            # the style is given by the (only) named group that matched
+            for name, fmt in styles.items():
+                if match.capturedStart(name) != -1:
+                    self.setFormat(match.capturedStart(), match.capturedLength(), fmt)
+                    break
 
 
 class SearchWidget(QtWidgets.QWidget):
@@ -344,7 +422,7 @@ class SearchWidget(QtWidgets.QWidget):
         # line edit
         self.edit = QtWidgets.QLineEdit()
         self.edit.setMaximumWidth(500)
-        self.edit.textChanged.connect(self.update_search)
+        self.edit.textChanged.connect(self.search_timer_start)
 
         # previous button
         self.button_previous = QtWidgets.QPushButton('<')
@@ -359,8 +437,15 @@ class SearchWidget(QtWidgets.QWidget):
         # internal parameters
         self.target = None
         self.all_extra_selections = []
+        self.all_start_positions = []
         self.current_extra_selection = []
 
+        # updates of the search are delayed while typing
+        self.search_timer = QtCore.QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(search_delay)
+        self.search_timer.timeout.connect(self.update_search)
+
         # layout window
         layout = QtWidgets.QHBoxLayout(self)
         layout.addWidget(self.label)
@@ -382,19 +467,26 @@ class SearchWidget(QtWidgets.QWidget):
         """
         # update target and connect
         self.target = target
-        self.target.textChanged.connect(self.update_search)
+        self.target.textChanged.connect(self.search_timer_start)
         # update display
         self.label.setText('Search in ({})'.format(target.mode))
         self.edit.setText('')
         self.edit.setFocus()
 
+    def search_timer_start(self):
+        """
+        The search text or the searched text has changed. Update the search after a short delay.
+        """
+        self.search_timer.start()
+
     def update_search(self):
         """
-        The search text has changed. Update the selections.
+        The search text has changed. Update the selections (only the first ones, for very many results).
         """
         search_text = self.edit.text()
 
         self.all_extra_selections = []
+        self.all_start_positions = []
         self.current_extra_selection = []
 
         if search_text:
@@ -403,7 +495,7 @@ class SearchWidget(QtWidgets.QWidget):
             # find all occurrences of the search string in the document and highlight them
             cursor = self.target.textCursor()
             cursor.setPosition(0)
-            while True:
+            while len(self.all_extra_selections) < maximum_search_results:
                 cursor = document.find(search_text, cursor)
                 if cursor.position() == -1:
                     break
@@ -411,6 +503,7 @@ class SearchWidget(QtWidgets.QWidget):
                 extra_selection.cursor = cursor
                 extra_selection.format = self.fmt_all
                 self.all_extra_selections.append(extra_selection)
+                self.all_start_positions.append(cursor.selectionStart())
 
         self.update()
 
@@ -465,18 +558,15 @@ class SearchWidget(QtWidgets.QWidget):
         """
         self.target.setExtraSelections(self.all_extra_selections + self.current_extra_selection)
 
-        # determine if search forward, backward is possible
-        previous_search_possible = False
-        next_search_possible = False
-        search_text = self.edit.text()
-        if search_text:
-            document = self.target.document()
-            cursor = self.target.textCursor()
-            cursor = document.find(search_text, cursor)
+        # determine if search forward, backward is possible (from the sorted start positions of all search results,
+        # searching the document only if there may be more results than are highlighted)
+        cursor = self.target.textCursor()
+        positions = self.all_start_positions
+        previous_search_possible = bisect.bisect_left(positions, cursor.selectionStart()) > 0
+        next_search_possible = bisect.bisect_left(positions, cursor.selectionEnd()) < len(positions)
+        if not next_search_possible and len(positions) >= maximum_search_results:
+            cursor = self.target.document().find(self.edit.text(), cursor)
             next_search_possible = cursor.position() != -1
-            cursor = self.target.textCursor()
-            cursor = document.find(search_text, cursor, QtGui.QTextDocument.FindBackward)
-            previous_search_possible = cursor.position() != -1
 
         # enable/disable buttons
         self.button_previous.setEnabled(previous_search_possible)
@@ -486,8 +576,10 @@ class SearchWidget(QtWidgets.QWidget):
         """
         Resets the search text, hides the widget and returns the focus to the target.
         """
-        self.target.textChanged.disconnect(self.update_search)
+        self.target.textChanged.disconnect(self.search_timer_start)
         self.edit.setText('')
+        self.search_timer.stop()
+        self.update_search()  # removes the highlighted search results
         self.hide()
         self.target.setFocus()
 
@@ -520,8 +612,9 @@ class MainWindow(QtWidgets.QWidget):
         self.resize(settings['window.size.width'], settings['window.size.height'])
         self.setWindowTitle('Lark Tester')
 
-        # use a fixed size font
+        # use a fixed size font for all text edits (set once for the class instead of on every edit)
         font = QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont)
+        QtWidgets.QApplication.setFont(font, 'QPlainTextEdit')
         font_metrics = QtGui.QFontMetrics(font)
         tabstopwidth = 4 * font_metrics.horizontalAdvance(' ')
 
@@ -530,67 +623,21 @@ class MainWindow(QtWidgets.QWidget):
 
         # grammar tabs
         grammar_groupbox = QtWidgets.QGroupBox('Grammar')
-        self.grammar_tabs = TabWidget()
-        self.grammars = []
-        self.grammar_highlighters = []
-        files = settings['grammar.files']
-        for i in range(number_tabs):
-            tooltip_changer = partial(self.grammar_tabs.setTabToolTip, i)
-            edit = TextEdit('grammar', tooltip_changer)
-            edit.setFont(font)
-            edit.setTabStopWidth(tabstopwidth)
-            if not wrap_lines:
-                edit.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
-            self.grammar_tabs.addTab(edit, '{}'.format(i+1))
-            self.grammars.append(edit)
-            self.grammar_highlighters.append(LarkHighlighter(edit.document()))
-            if files[i]:
-                edit.load(files[i])
-        self.grammar_tabs.setCurrentIndex(settings['grammar.active_tab'])
+        self.grammar_tabs, self.grammars, self.grammar_highlighters = self.create_tabs('grammar', LarkHighlighter, tabstopwidth)
         l = QtWidgets.QVBoxLayout()
         l.addWidget(self.grammar_tabs)
         grammar_groupbox.setLayout(l)
 
         # transformer tabs
         transformer_groupbox = QtWidgets.QGroupBox('Transformer')
-        self.transformer_tabs = TabWidget()
-        self.transformers = []
-        self.transformer_highlighters = []
-        files = settings['transformer.files']
-        for i in range(number_tabs):
-            tooltip_changer = partial(self.transformer_tabs.setTabToolTip, i)
-            edit = TextEdit('transformer', tooltip_changer)
-            edit.setFont(font)
-            edit.setTabStopWidth(tabstopwidth)
-            if not wrap_lines:
-                edit.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
-            self.transformer_tabs.addTab(edit, '{}'.format(i+1))
-            self.transformers.append(edit)
-            self.transformer_highlighters.append(common.PythonHighlighter(edit.document()))
-            if files[i]:
-                edit.load(files[i])
-        self.transformer_tabs.setCurrentIndex(settings['transformer.active_tab'])
+        self.transformer_tabs, self.transformers, self.transformer_highlighters = self.create_tabs('transformer', common.PythonHighlighter, tabstopwidth)
         l = QtWidgets.QVBoxLayout()
         l.addWidget(self.transformer_tabs)
         transformer_groupbox.setLayout(l)
 
         # test content tabs
         content_groupbox = QtWidgets.QGroupBox('Test content')
-        self.content_tabs = TabWidget()
-        self.contents = []
-        files = settings['content.files']
-        for i in range(number_tabs):
-            tooltip_changer = partial(self.content_tabs.setTabToolTip, i)
-            edit = TextEdit('content', tooltip_changer)
-            edit.setFont(font)
-            edit.setTabStopWidth(tabstopwidth)
-            if not wrap_lines:
-                edit.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
-            self.content_tabs.addTab(edit, '{}'.format(i+1))
-            self.contents.append(edit)
-            if files[i]:
-                edit.load(files[i])
-        self.content_tabs.setCurrentIndex(settings['content.active_tab'])
+        self.content_tabs, self.contents, _ = self.create_tabs('content', None, tabstopwidth)
         l = QtWidgets.QVBoxLayout()
         l.addWidget(self.content_tabs)
         content_groupbox.setLayout(l)
@@ -600,7 +647,6 @@ class MainWindow(QtWidgets.QWidget):
         self.parsed = TextDisplay('parsed')
         self.parsed.setReadOnly(True)
         self.parsed.setTextInteractionFlags(QtCore.Qt.TextSelectableByMouse | QtCore.Qt.TextSelectableByKeyboard)
-        self.parsed.setFont(font)
         if not wrap_lines:
             self.parsed.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
         l = QtWidgets.QVBoxLayout()
@@ -612,31 +658,31 @@ class MainWindow(QtWidgets.QWidget):
         self.transformed = TextDisplay('transformed')
         self.transformed.setReadOnly(True)
         self.transformed.setTextInteractionFlags(QtCore.Qt.TextSelectableByMouse | QtCore.Qt.TextSelectableByKeyboard)
-        self.transformed.setFont(font)
         if not wrap_lines:
             self.transformed.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
         l = QtWidgets.QVBoxLayout()
         l.addWidget(self.transformed)
         transformed_groupbox.setLayout(l)
 
-        # help window
-        self.help_window = QtWidgets.QTextEdit(self)
-        self.help_window.setWindowTitle('Help')
-        self.help_window.setMinimumSize(int(minimal_window_size[0] * 0.8), int(minimal_window_size[1] * 0.8))
-        self.help_window.setReadOnly(True)
-        self.help_window.setWindowModality(QtCore.Qt.WindowModal)
-        self.help_window.setWindowFlags(QtCore.Qt.Window)
-        self.help_window.setMarkdown(readme_text)
-        cursor = self.help_window.textCursor()
-        self.help_window.selectAll()
-        self.help_window.setFontPointSize(10)  # for some reason the default is quite small
-        cursor.clearSelection()
-        self.help_window.setTextCursor(cursor)
-        self.help_window.setTextInteractionFlags(QtCore.Qt.TextSelectableByMouse | QtCore.Qt.TextSelectableByKeyboard | QtCore.Qt.LinksAccessibleByMouse | QtCore.Qt.LinksAccessibleByKeyboard)
-
-
-        # settings window
-        self.settings_window = SettingsWindow(self)
+        # Lark runs happen in a single worker thread, the last started run is stored
+        self.lark_thread_pool = QtCore.QThreadPool(self)
+        self.lark_thread_pool.setMaxThreadCount(1)
+        self.lark_run = None
+        self.earley_warning_shown = False
+
+        # delays the update signal, so that bursts of update requests only result in a single Lark run
+        self.update_timer = QtCore.QTimer(self)
+        self.update_timer.setSingleShot(True)
+        self.update_timer.setInterval(update_delay)
+        self.update_timer.timeout.connect(self.update.emit)
+
+        # changes of grammar, transformer or test content restart the delayed update (if desired)
+        for edit in self.grammars + self.transformers + self.contents:
+            edit.textChanged.connect(self.text_changed)
+
+        # help and settings window (created when shown for the first time)
+        self.help_window = None
+        self.settings_window = None
 
         # search area
         self.search_area = SearchWidget()
@@ -648,7 +694,7 @@ class MainWindow(QtWidgets.QWidget):
         # parse and transform action
         action = QtWidgets.QAction(load_icon('go'), 'Parse and transform (F5)', self)
         action.setShortcut(QtGui.QKeySequence(QtCore.Qt.Key_F5))
-        action.triggered.connect(self.update.emit)
+        action.triggered.connect(self.update_timer.start)
         toolbar.addAction(action)
 
         toolbar.addSeparator()
@@ -681,13 +727,13 @@ class MainWindow(QtWidgets.QWidget):
 
         # show settings action
         action = QtWidgets.QAction(load_icon('settings'), 'Settings', self)
-        action.triggered.connect(self.settings_window.show)
+        action.triggered.connect(self.settings_action)
         toolbar.addAction(action)
 
         # show help action
         action = QtWidgets.QAction(load_icon('help'), 'Help (F1)', self)
         action.setShortcut(QtGui.QKeySequence(QtCore.Qt.Key_F1))
-        action.triggered.connect(self.help_window.show)
+        action.triggered.connect(self.help_action)
         toolbar.addAction(action)
 
         # status bar
@@ -710,6 +756,7 @@ class MainWindow(QtWidgets.QWidget):
         sz = settings['window.splitter.columns.size']
         if sz:
             self.column_splitter.setSizes(sz)
+        self.column_splitter.splitterMoved.connect(self.column_splitter_moved)
 
         # layout
         layout = QtWidgets.QVBoxLayout(self)
@@ -718,6 +765,43 @@ class MainWindow(QtWidgets.QWidget):
         layout.addWidget(self.column_splitter, stretch=1)
         layout.addWidget(self.statusbar)
 
+    def create_tabs(self, mode, highlighter_class, tabstopwidth):
+        """
+        Creates the tabs with the text edits of one mode, loads the files and selects the active tab from the settings.
+        :param mode: One of ('grammar', 'transformer', 'content').
+        :param highlighter_class: Syntax highlighter class for the text edits or None.
+        :param tabstopwidth: The tab stop width of the text edits.
+        :return: The tab widget, the list of text edits and the list of highlighters.
+        """
+        tabs = TabWidget()
+        edits = []
+        highlighters = []
+        files = settings[mode + '.files']
+        for i in range(number_tabs):
+            tooltip_changer = partial(tabs.setTabToolTip, i)
+            edit = TextEdit(mode, tooltip_changer)
+            edit.setTabStopWidth(tabstopwidth)
+            if not settings['options.edit.wrap_lines']:
+                edit.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
+            tabs.addTab(edit, '{}'.format(i+1))
+            edits.append(edit)
+            if highlighter_class:
+                highlighter = highlighter_class(edit.document())
+                highlighter.maximum_characters = settings['options.edit.highlight.maximum_characters']
+                highlighters.append(highlighter)
+            if files[i]:
+                edit.load_deferred(files[i])
+        tabs.setCurrentIndex(settings[mode + '.active_tab'])
+        return tabs, edits, highlighters
+
+    def text_changed(self):
+        """
+        The text of a grammar, transformer or test content has changed. If runs while typing are desired, (re)starts
+        the delayed update, so that only a pause in typing results in a Lark run.
+        """
+        if settings['options.lark.run_while_typing']:
+            self.update_timer.start()
+
     def content(self):
         """
         Retrieves the content of the actual test content tab.
@@ -736,6 +820,19 @@ class MainWindow(QtWidgets.QWidget):
         """
         return self.transformers[self.transformer_tabs.currentIndex()].toPlainText()
 
+    def is_parsed_shown(self):
+        """
+        :return: True if the parsed tree output is visible (not collapsed in the splitter).
+        """
+        return self.parsed.isVisible() and self.column_splitter.sizes()[1] > 0
+
+    def column_splitter_moved(self):
+        """
+        If the parsed tree output has been collapsed during the last Lark run, but is shown now, run again.
+        """
+        if self.lark_run and not self.lark_run.show_parsed and self.is_parsed_shown():
+            self.update_timer.start()
+
     def set_parsed(self, text):
         """
         Sets the content of the parsed output edit area to text.
@@ -816,6 +913,35 @@ class MainWindow(QtWidgets.QWidget):
                 self.search_area.start_search(focus)
                 self.search_area.show()
 
+    def settings_action(self):
+        """
+        The settings button has been pressed. The settings window is created when it is shown for the first time.
+        """
+        if self.settings_window is None:
+            self.settings_window = SettingsWindow(self)
+        self.settings_window.show()
+
+    def help_action(self):
+        """
+        The help button has been pressed. The help window is created and the readme is read and rendered when the help
+        window is shown for the first time.
+        """
+        if self.help_window is None:
+            self.help_window = QtWidgets.QTextEdit(self)
+            self.help_window.setWindowTitle('Help')
+            self.help_window.setMinimumSize(int(minimal_window_size[0] * 0.8), int(minimal_window_size[1] * 0.8))
+            self.help_window.setReadOnly(True)
+            self.help_window.setWindowModality(QtCore.Qt.WindowModal)
+            self.help_window.setWindowFlags(QtCore.Qt.Window)
+            self.help_window.setTextInteractionFlags(QtCore.Qt.TextSelectableByMouse | QtCore.Qt.TextSelectableByKeyboard | QtCore.Qt.LinksAccessibleByMouse | QtCore.Qt.LinksAccessibleByKeyboard)
+            self.help_window.setMarkdown(common.read_text(os.path.join(root_path, 'README.md')))
+            cursor = self.help_window.textCursor()
+            self.help_window.selectAll()
+            self.help_window.setFontPointSize(10)  # for some reason the default is quite small
+            cursor.clearSelection()
+            self.help_window.setTextCursor(cursor)
+        self.help_window.show()
+
     def closeEvent(self, event: QtGui.QCloseEvent) -> None:
         """
         Before the main window (and with it the application) can be closed, we need to check for unsaved modifications
@@ -849,57 +975,269 @@ class MainWindow(QtWidgets.QWidget):
         settings['transformer.active_tab'] = self.transformer_tabs.currentIndex()
         settings['content.active_tab'] = self.content_tabs.currentIndex()
 
-        # save setting
+        # save settings (only if they changed, the sorted output is the same for the same settings)
         text = json.dumps(settings, indent=1, sort_keys=True)
-        common.write_text(settings_file, text)
+        if text != settings_file_text:
+            common.write_text_atomically(settings_file, text)
+
+        # no further Lark runs, queued runs are discarded (a running run cannot be interrupted, its result is dropped)
+        self.update_timer.stop()
+        self.lark_thread_pool.clear()  # before dropping the last reference to a queued run
+        self.lark_run = None
 
         event.accept()
 
 
+@lru_cache(maxsize=8)
+def create_parser(grammar, start, parser):
+    """
+    Creates a Lark parser. Building the parser is expensive compared to parsing small test contents, therefore the
+    last parsers are cached and reused as long as grammar and options stay the same. LALR parsers are additionally
+    cached on disk by Lark (in the cache directory of the user), which also speeds up the first run after a restart.
+    :param grammar: The Lark grammar text.
+    :param start: The starting rule.
+    :param parser: The Lark parser algorithm.
+    :return: The Lark parser.
+    """
+    cache_file = parser_cache_file(grammar, start, parser) if parser == 'lalr' else None
+    return Lark(grammar, start=start, parser=parser, debug=False, cache=cache_file or False)
+
+
+def parser_cache_file(grammar, start, parser):
+    """
+    The file that Lark caches a parser in. Lark loads the cache file with pickle, so it must not be in a shared
+    location (like the temp directory), where other users could plant a cache file.
+    :param grammar: The Lark grammar text.
+    :param start: The starting rule.
+    :param parser: The Lark parser algorithm.
+    :return: The path of the cache file in the cache directory of the user or None if there is no such directory.
+    """
+    directory = QtCore.QStandardPaths.writableLocation(QtCore.QStandardPaths.GenericCacheLocation)
+    if not directory:
+        return None
+    directory = os.path.join(directory, 'lark-tester')
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    except OSError:
+        return None
+    key = hashlib.md5('\n'.join((grammar, start, parser)).encode('utf-8')).hexdigest()
+    return os.path.join(directory, key + '.lark')
+
+
+@lru_cache(maxsize=8)
+def compile_transformer(transformer):
+    """
+    Compiles the transformer code. The transformer usually changes less often than the test content, therefore the
+    last compiled transformers are cached and reused.
+    :param transformer: The transformer Python code.
+    :return: The compiled code object.
+    """
+    return compile(transformer, '<transformer>', 'exec')
+
+
+def pretty_tree(tree, indent_str='  ', maximum_length=None):
+    """
+    Same output as Tree.pretty() of Lark, but writes into a single buffer (iteratively) instead of concatenating the
+    lists of strings of all subtrees, which copies the lines of deep trees again on every level.
+    :param tree: The Lark tree.
+    :param indent_str: The indentation per level.
+    :param maximum_length: If given, the output is truncated after this many characters (and the rest of the tree is
+    not visited).
+    :return: An indented string representation of the tree.
+    """
+    output = io.StringIO()
+    write = output.write
+    stack = [(tree, 0)]
+    while stack:
+        if maximum_length is not None and output.tell() > maximum_length:
+            break
+        node, level = stack.pop()
+        if not isinstance(node, Tree):
+            write('{}{}\n'.format(indent_str * level, node))
+        elif len(node.children) == 1 and not isinstance(node.children[0], Tree):
+            write('{}{}\t{}\n'.format(indent_str * level, node.data, node.children[0]))
+        else:
+            write('{}{}\n'.format(indent_str * level, node.data))
+            stack.extend((child, level + 1) for child in reversed(node.children))
+    return truncate_text(output.getvalue(), maximum_length)
+
+
+def join_lines(lines, maximum_length=None):
+    """
+    Joins lines with newlines. Stops taking lines (and truncates) after a maximum length, so that for very long
+    results not all lines have to be formatted.
+    :param lines: Iterable of lines (str).
+    :param maximum_length: If not None, the maximal number of characters before the output is truncated.
+    :return: The joined text.
+    """
+    taken = []
+    length = 0
+    for line in lines:
+        taken.append(line)
+        length += len(line) + 1
+        if maximum_length is not None and length > maximum_length:
+            break
+    return truncate_text('\n'.join(taken), maximum_length)
+
+
+def truncate_text(text, maximum_length=None):
+    """
+    Truncates a text after a maximum length and marks it as truncated.
+    :param text: The text.
+    :param maximum_length: If not None, the maximal number of characters.
+    :return: The (possibly truncated) text.
+    """
+    if maximum_length is not None and len(text) > maximum_length:
+        text = text[:maximum_length] + '\n...(truncated)\n'
+    return text
+
+
+class LarkRun(QtCore.QRunnable):
+    """
+    One complete Lark run (parse and transform). Runs in a worker thread, so that the GUI stays responsive during
+    long parses. Only stores the results, they are displayed by show_lark_run in the GUI thread.
+    """
+
+    class Signals(QtCore.QObject):
+        """
+        A QRunnable is not a QObject and cannot have signals itself.
+        """
+
+        #: signal, the run has finished
+        finished = QtCore.pyqtSignal(object)
+
+    def __init__(self, grammar, start, parser, content, transformer, show_parsed=True):
+        """
+        Stores the input of the run. The input is taken from the GUI thread beforehand.
+        If the parsed tree is not shown, it is not converted to text.
+        """
+        super().__init__()
+        self.setAutoDelete(False)  # we keep a reference ourselves
+        self.signals = LarkRun.Signals()
+        self.grammar = grammar
+        self.start = start
+        self.parser = parser
+        self.content = content
+        self.transformer = transformer
+        self.show_parsed = show_parsed
+
+        # results
+        self.parsed = ''
+        self.parse_error = None
+        self.transformed = ''
+        self.transform_error = None
+
+    def run(self):
+        """
+        Parses and transforms, then signals that the results are ready.
+        """
+        try:
+            self.parse_and_transform()
+        finally:
+            try:
+                self.signals.finished.emit(self)
+            except RuntimeError:
+                # the application is shutting down and the signals object has already been deleted, nobody is
+                # interested in the result anymore
+                pass
+
+    def parse_and_transform(self):
+        """
+        Parses the content with the grammar and transforms the parsed tree with the transformer.
+        """
+        # first the parse
+        try:
+            parser = create_parser(self.grammar, self.start, self.parser)
+            parsed_tree = parser.parse(self.content)
+        except Exception as e:
+            self.parse_error = '{}: {}'.format(type(e).__name__, e)
+            # self.parse_error = traceback.format_exc()
+
+            # no need to transform
+            return
+        if self.show_parsed:
+            self.parsed = pretty_tree(parsed_tree, maximum_length=maximum_parsed_length)
+
+        # then transform
+        try:
+            # TODO make sure that the class is really called MyTransformer and maybe sanitize or other security checks
+            # the transformer runs in its own namespace, which provides the Lark names it might use
+            namespace = {'Lark': Lark, 'Tree': Tree, 'Transformer': Transformer, 'Discard': Discard, 'v_args': v_args}
+            exec(compile_transformer(self.transformer), namespace)
+            if 'MyTransformer' not in namespace:
+                raise NameError("name 'MyTransformer' is not defined")
+            transformed_object = namespace['MyTransformer']().transform(parsed_tree)
+            if isinstance(transformed_object, (list, tuple)):
+                self.transformed = join_lines(map(str, transformed_object), maximum_transformed_length)
+            elif isinstance(transformed_object, dict):
+                self.transformed = join_lines(('{}: {}'.format(k, v) for k, v in transformed_object.items()), maximum_transformed_length)
+            else:
+                self.transformed = truncate_text(str(transformed_object), maximum_transformed_length)
+        except Exception as e:
+            self.transform_error = '{}: {}'.format(type(e).__name__, e)
+            # self.transform_error = traceback.format_exc()
+
+
 def update(main_window: MainWindow):
     """
-    One complete Lark run.
-    :param main_window: The main window to retrieve and set text.
+    Starts one complete Lark run in the background.
+    :param main_window: The main window to retrieve text.
     """
     # TODO time execution of parsing and transforming and display as message
 
-    # first the parse
     grammar = main_window.grammar()
+    if not grammar.strip():
+        # nothing to build a parser from, also no older run should be displayed anymore
+        main_window.lark_thread_pool.clear()  # before dropping the last reference to a queued run
+        main_window.lark_run = None
+        main_window.set_parsed('')
+        main_window.set_transformed('')
+        return
+
+    parser = lark_parsers[settings['options.lark.parser']]
     content = main_window.content()
-    try:
-        parser = Lark(grammar, start=settings['options.lark.starting_rule'], parser=lark_parsers[settings['options.lark.parser']], debug=False)
-        parsed_tree = parser.parse(content)
-    except Exception as e:
-        main_window.set_parsed_error('{}: {}'.format(type(e).__name__, e))
-        # main_window.set_parsed_error(traceback.format_exc())
-        main_window.show_message('Exception during parse')
+    if parser == 'earley' and len(content) > large_earley_content_length and not main_window.earley_warning_shown:
+        main_window.earley_warning_shown = True
+        main_window.show_message('Large content, the LALR(1) parser might be much faster than Earley')
 
-        # no need to transform
+    run = LarkRun(grammar, settings['options.lark.starting_rule'], parser, content, main_window.transformer(), main_window.is_parsed_shown())
+    run.signals.finished.connect(partial(show_lark_run, main_window))
+
+    # only the latest run is of interest, a run that has not started yet is replaced (the queued run is removed from
+    # the pool before its last reference is dropped, it is not auto deleted)
+    main_window.lark_thread_pool.clear()
+    main_window.lark_run = run
+    main_window.lark_thread_pool.start(run)
+
+
+def show_lark_run(main_window: MainWindow, run: LarkRun):
+    """
+    Displays the results of a finished Lark run (in the GUI thread).
+    :param main_window: The main window to set text.
+    :param run: The finished run.
+    """
+    # outdated results (a newer run has been started in the meantime) are not shown
+    if run is not main_window.lark_run:
+        return
+
+    if run.parse_error:
+        main_window.set_parsed_error(run.parse_error)
+        main_window.show_message('Exception during parse')
         main_window.set_transformed('')
         return
-    main_window.set_parsed(parsed_tree.pretty())
+    main_window.set_parsed(run.parsed)
 
-    # then transform
-    transformer = main_window.transformer()
-    try:
-        # TODO make sure that the class is really called MyTransformer and maybe sanitize or other security checks
-        exec(transformer, globals(), globals())
-        transformed_object = MyTransformer().transform(parsed_tree)  # MyTransformer should be a resolved reference at runtime
-        if isinstance(transformed_object, (list, tuple)):
-            main_window.set_transformed('\n'.join((str(x) for x in transformed_object)))
-        elif isinstance(transformed_object, dict):
-            main_window.set_transformed('\n'.join(('{}: {}'.format(k, v) for k, v in transformed_object.items())))
-        else:
-            main_window.set_transformed(str(transformed_object))
-    except Exception as e:
-        main_window.set_transformed_error('{}: {}'.format(type(e).__name__, e))
-        # main_window.set_transformed_error(traceback.format_exc())
+    if run.transform_error:
+        main_window.set_transformed_error(run.transform_error)
         main_window.show_message('Exception during transform')
+    else:
+        main_window.set_transformed(run.transformed)
 
 
+@lru_cache(maxsize=None)
 def load_icon(name):
     """
-    Loads an icon (as QIcon) from our resources place.
+    Loads an icon (as QIcon) from our resources place. Icons are only loaded once.
     :param name: Just the name part from the icon file.
     :return: The QIcon.
     """
@@ -923,17 +1261,16 @@ if __name__ == '__main__':
     # root path is file path
     root_path = os.path.dirname(__file__)
 
-    # read readme file (for the help window)
-    readme_text = common.read_text(os.path.join(root_path, 'README.md'))
-
     # read settings
     settings_file = os.path.join(root_path, 'settings.json')
     settings = default_settings
+    settings_file_text = None
     try:
-        text = common.read_text(settings_file)
-        settings = json.loads(text)
-        # we delete all keys in settings that are not in default_settings (cleanup obsolete keys)
-        settings = {k: v for k, v in settings.items() if k in default_settings}
+        settings_file_text = common.read_text(settings_file)
+        settings = json.loads(settings_file_text)
+        # we delete all keys in settings that are not in default_settings (cleanup obsolete keys) and take missing
+        # keys (e.g. new settings) from default_settings
+        settings = {**default_settings, **{k: v for k, v in settings.items() if k in default_settings}}
     except:
         pass
 
@@ -957,7 +1294,11 @@ if __name__ == '__main__':
     window = MainWindow()
     window.show()
     window.update.connect(partial(update, window))
-    window.update.emit()
+    if settings['options.lark.run_while_typing']:
+        # loading the files of the shown tabs already started the delayed update, this only makes sure that there is one
+        window.update_timer.start()
+    else:
+        window.update.emit()
 
     # start Qt app execution
     sys.exit(app.exec_())